@@ -0,0 +1,10 @@
+import os
+import traceback
+
+try:
+    from .srig_layout_v1 import distributeVias
+    distributeVias().register()
+except (ImportError, AttributeError, RuntimeError):
+    logPath = os.path.join(os.path.dirname(__file__), 'registration.log')
+    with open(logPath, 'w') as f:
+        f.write(traceback.format_exc())
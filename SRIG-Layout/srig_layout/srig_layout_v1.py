@@ -0,0 +1,459 @@
+'''
+Helper script for laying out stacked ring ion guide (SRIG) electrodes on a PCB.
+Reads ring definitions (center, inner and outer diameter) from a CSV or JSON
+table and drops the vias, solder mask openings, and index labels onto the
+current board.  Also includes a few utilities for distributing selected
+footprints on a grid.  Run from the KiCad scripting console or as an action
+plugin (see __init__.py).
+'''
+import os
+import re
+import csv
+import copy
+import json
+import functools
+import threading
+import traceback
+from collections import namedtuple
+
+import numpy as np
+import pandas as pd
+
+try:
+    import orjson  # C JSON parser, well worth it on big numeric tables
+except ImportError:
+    orjson = None
+
+import wx
+import pcbnew
+
+# mmToIU is a pure scale factor, so resolve it once and inline the multiply
+# instead of crossing the SWIG boundary three times per via
+IU_PER_MM = float(pcbnew.pcbIUScale.mmToIU(1.0))
+IU_PER_MIL = float(pcbnew.pcbIUScale.MilsToIU(1.0))
+assert int(pcbnew.pcbIUScale.mmToIU(2.5)) == int(2.5 * IU_PER_MM)
+
+# SoA container for the ring table: one row per via, columns are the ring
+# index, center coordinates (mm), inner diameter (mm), and outer diameter (mm)
+Vias = namedtuple('Vias', ['idx', 'X', 'Y', 'ID', 'OD'])
+
+
+# Parsed tables are cached on (path, mtime, size) so reopening the plugin
+# dialog against the same file skips the parse entirely; an edited file gets
+# a fresh stat signature and misses the cache.
+
+@functools.lru_cache(maxsize=16)
+def _loadCSV(path, mtime_ns, size):
+    df = pd.read_csv(path, usecols=['index', 'X', 'Y', 'ID', 'OD'])
+    idx = df['index'].to_numpy(np.int64)
+    order = np.argsort(idx, kind='stable')
+    vias = Vias(idx[order],
+                df['X'].to_numpy(np.float64)[order],
+                df['Y'].to_numpy(np.float64)[order],
+                df['ID'].to_numpy(np.float64)[order],
+                df['OD'].to_numpy(np.float64)[order])
+    for arr in vias:
+        arr.setflags(write=False)  # cached result, keep callers from mutating
+    return vias
+
+
+@functools.lru_cache(maxsize=16)
+def _loadJSON(path, mtime_ns, size):
+    # 1 MiB buffer: multi-MB ring tables shouldn't be read 8 KiB at a time
+    with open(path, 'rb', buffering=1 << 20) as f:
+        if orjson is not None:
+            return orjson.loads(f.read())
+        return json.load(f)
+
+
+def restoreCSV(inputName):
+    '''Read the ring table CSV into contiguous numpy arrays (one per column).
+    Rows are returned in ascending order of the index column.'''
+    st = os.stat(inputName)
+    return _loadCSV(inputName, st.st_mtime_ns, st.st_size)
+
+
+def restoreJSON(inputName):
+    '''Read a ring table JSON (dict of index -> {X, Y, ID, OD}).'''
+    st = os.stat(inputName)
+    # hand out a copy: the cached dict is shared, and a caller tweaking a
+    # ring in the console must not poison later loads of the unchanged file
+    return copy.deepcopy(_loadJSON(inputName, st.st_mtime_ns, st.st_size))
+
+
+def dumpJSON(dataDict, outputName):
+    if orjson is not None:
+        # OPT_NON_STR_KEYS: stdlib json stringifies int keys silently, and
+        # ring dicts built in the console are naturally int-keyed -- keep the
+        # two branches accepting the same input
+        with open(outputName, 'wb', buffering=1 << 20) as f:
+            f.write(orjson.dumps(dataDict,
+                                 option=orjson.OPT_INDENT_2
+                                 | orjson.OPT_NON_STR_KEYS))
+    else:
+        with open(outputName, 'w', buffering=1 << 20) as f:
+            json.dump(dataDict, f, indent=2)
+
+
+def convertJSONtoCSV(inputName, csvName=None):
+    '''Flatten a ring table JSON into the CSV format restoreCSV expects.'''
+    jd = restoreJSON(inputName)
+    if csvName is None:
+        csvName = os.path.splitext(inputName)[0] + '.csv'
+    keyList = sorted(map(int, jd.keys()))
+    with open(csvName, 'w', newline='', buffering=1 << 20) as f:
+        writer = csv.writer(f)
+        writer.writerow(['index', 'X', 'Y', 'ID', 'OD'])
+        writer.writerows((k, v['X'], v['Y'], v['ID'], v['OD'])
+                         for k in keyList for v in (jd[str(k)],))
+    return csvName
+
+
+_TOK = re.compile(r'([0-9]+)')
+
+
+@functools.lru_cache(maxsize=None)
+def _nkey(s: str):
+    return tuple(int(c) if c.isdigit() else c.lower() for c in _TOK.split(s))
+
+
+def natural_sort(l):
+    '''Sort strings so that R2 comes before R10.'''
+    return sorted(l, key=_nkey)
+
+
+# footprint references are a letter prefix plus a numeric suffix (R12, C104)
+_REF_RE = re.compile(r'^([^0-9]*)(\d+)$')
+
+
+def _split_ref(ref: str):
+    '''Split a reference into (prefix, number) for numeric-aware ordering.'''
+    m = _REF_RE.match(ref)
+    if m:
+        return m.group(1), int(m.group(2))
+    return ref, -1
+
+
+def _natural_order(refs):
+    '''Return indices that order refs naturally, via one numpy lexsort instead
+    of a Python sort with per-comparison regex splits.'''
+    if not refs:
+        return []
+    prefixes, nums = zip(*[_split_ref(r) for r in refs])
+    return np.lexsort((np.array(nums, dtype=np.int64), np.array(prefixes)))
+
+
+# The wx -> VECTOR2I shim dispatches on argument type once instead of probing
+# attributes on every call; a VECTOR2I passes straight through.
+
+@functools.singledispatch
+def vec_from_size(sz) -> 'pcbnew.VECTOR2I':
+    '''wxSize -> VECTOR2I shim for the KiCad 7 API.'''
+    return pcbnew.VECTOR2I(int(sz.GetWidth()), int(sz.GetHeight()))
+
+
+@vec_from_size.register(pcbnew.VECTOR2I)
+def _vec_passthrough(v: 'pcbnew.VECTOR2I') -> 'pcbnew.VECTOR2I':
+    return v
+
+
+@functools.lru_cache(maxsize=1)
+def _labelSize():
+    '''The 2 mm label size in whichever type SetTextSize wants.  Probed once
+    on a throwaway PCB_TEXT instead of trying/excepting per label: KiCad 6
+    takes a wxSize, KiCad 7 a VECTOR2I.'''
+    size = pcbnew.wxSizeMM(2, 2)
+    probe = pcbnew.PCB_TEXT(None)
+    try:
+        probe.SetTextSize(size)
+        return size
+    except TypeError:
+        return vec_from_size(size)
+
+
+# per-session lookups that create_via would otherwise re-resolve on every
+# call: layer IDs and the via type constant
+Ctx = namedtuple('Ctx', ['FCu', 'BCu', 'FMask', 'BMask', 'SilkS', 'viaType'])
+
+
+def makeCtx(board):
+    '''Resolve the board lookups create_via needs, once per placement run.'''
+    return Ctx(FCu=board.GetLayerID('F.Cu'),
+               BCu=board.GetLayerID('B.Cu'),
+               FMask=board.GetLayerID('F.Mask'),
+               BMask=board.GetLayerID('B.Mask'),
+               SilkS=board.GetLayerID('F.SilkS'),
+               viaType=pcbnew.VIATYPE_THROUGH)
+
+
+def create_via_iu(board, net, xIU, yIU, drillIU, widthIU, endxIU, ctx, adder):
+    '''Place a single through via at (xIU, yIU), with matching solder mask
+    openings on both sides so the annular ring is exposed.  All geometry comes
+    in pre-scaled to integer IU, so no unit conversion happens here.  New
+    items go through adder.Add (a BOARD_COMMIT, or the board itself as a
+    fallback).'''
+    newvia = pcbnew.PCB_VIA(board)
+    newvia.SetPosition(pcbnew.VECTOR2I(xIU, yIU))
+    newvia.SetDrill(drillIU)
+    newvia.SetWidth(widthIU)
+    newvia.SetViaType(ctx.viaType)
+    newvia.SetLayerPair(ctx.FCu, ctx.BCu)
+    newvia.SetNet(net)
+    adder.Add(newvia)
+
+    for maskLayer in (ctx.FMask, ctx.BMask):
+        maskCir = pcbnew.PCB_SHAPE(board)
+        maskCir.SetShape(pcbnew.SHAPE_T_CIRCLE)
+        maskCir.SetFilled(True)
+        maskCir.SetLayer(maskLayer)
+        # Start is the circle center, End a point on the circumference:
+        # center plus the opening radius along X
+        maskCir.SetStart(pcbnew.VECTOR2I(xIU, yIU))
+        maskCir.SetEnd(pcbnew.VECTOR2I(endxIU, yIU))
+        maskCir.SetWidth(0)
+        adder.Add(maskCir)
+
+    return newvia
+
+
+def create_via(board, net, xPos, yPos, drillSize, drillWidth, ctx, adder):
+    '''mm-unit wrapper around create_via_iu, for one-off console use.'''
+    xIU = int(xPos * IU_PER_MM)
+    return create_via_iu(board, net, xIU, int(yPos * IU_PER_MM),
+                         int(drillSize * IU_PER_MM),
+                         int(drillWidth * IU_PER_MM),
+                         xIU + int(drillWidth / 2 * IU_PER_MM),
+                         ctx, adder)
+
+
+def _viasFromDict(viaDict):
+    '''Convert a JSON ring dict (index -> {X, Y, ID, OD}) to the Vias SoA,
+    ordered by integer index.'''
+    keyList = sorted(map(int, viaDict.keys()))
+    rowList = [viaDict[str(k)] for k in keyList]
+    n = len(keyList)
+    return Vias(np.fromiter(keyList, np.int64, n),
+                np.fromiter((float(r['X']) for r in rowList), np.float64, n),
+                np.fromiter((float(r['Y']) for r in rowList), np.float64, n),
+                np.fromiter((float(r['ID']) for r in rowList), np.float64, n),
+                np.fromiter((float(r['OD']) for r in rowList), np.float64, n))
+
+
+# vectorized half of a placement: everything here is plain numpy with no
+# pcbnew objects, so it is safe to compute on a worker thread
+Plan = namedtuple('Plan', ['vias', 'cx', 'cy', 'cxIU', 'cyIU', 'tyIU',
+                           'drillIU', 'widthIU', 'endxIU'])
+
+# board-side state for a placement in progress
+Session = namedtuple('Session', ['pcb', 'net', 'ctx', 'commit', 'adder',
+                                 'labelSize'])
+
+# rings per wx.CallAfter batch when placing asynchronously
+_BATCH = 128
+
+
+def _computePlacement(vias, xStep, yStep, numCols, originX=0.0, originY=0.0):
+    '''Grid coordinates, label anchors, and IU-scaled geometry for every
+    ring, computed in a few vectorized passes.'''
+    n = len(vias.idx)
+    col = np.arange(n) % numCols
+    row = np.arange(n) // numCols
+    cx = vias.X + xStep * col + originX
+    cy = vias.Y + yStep * row + originY
+    ty = cy + vias.OD / 2 + 4
+
+    cxIU = (cx * IU_PER_MM).astype(np.int64)
+    cyIU = (cy * IU_PER_MM).astype(np.int64)
+    tyIU = (ty * IU_PER_MM).astype(np.int64)
+    drillIU = (vias.ID * IU_PER_MM).astype(np.int64)
+    widthIU = (vias.OD * IU_PER_MM).astype(np.int64)
+    endxIU = cxIU + (vias.OD / 2 * IU_PER_MM).astype(np.int64)
+    return Plan(vias, cx, cy, cxIU, cyIU, tyIU, drillIU, widthIU, endxIU)
+
+
+def _beginSession(plan):
+    '''Resolve the board-side state for a placement.  Must run on the UI
+    thread, like everything else that touches the board.'''
+    pcb = pcbnew.GetBoard()
+    # batch all Adds into one commit so KiCad rebuilds its view/RTree once
+    # instead of once per item
+    commit = pcbnew.BOARD_COMMIT(pcb) if hasattr(pcbnew, 'BOARD_COMMIT') else None
+    return Session(pcb=pcb,
+                   net=pcb.FindNet(''),
+                   ctx=makeCtx(pcb),
+                   commit=commit,
+                   adder=commit if commit is not None else pcb,
+                   labelSize=_labelSize())
+
+
+def _placeRange(plan, sess, start, stop):
+    '''Place rings start..stop of the plan onto the board.'''
+    for i in range(start, stop):
+        create_via_iu(sess.pcb, sess.net, int(plan.cxIU[i]), int(plan.cyIU[i]),
+                      int(plan.drillIU[i]), int(plan.widthIU[i]),
+                      int(plan.endxIU[i]), sess.ctx, sess.adder)
+
+        # label each ring just below its outer edge
+        txt = pcbnew.PCB_TEXT(sess.pcb)
+        txt.SetText(str(plan.vias.idx[i]))
+        txt.SetPosition(pcbnew.VECTOR2I(int(plan.cxIU[i]), int(plan.tyIU[i])))
+        txt.SetTextSize(sess.labelSize)
+        txt.SetLayer(sess.ctx.SilkS)
+        sess.adder.Add(txt)
+
+
+def _endSession(sess):
+    if sess.commit is not None:
+        sess.commit.Push('SRIG grid layout')
+    else:
+        pcbnew.Refresh()
+
+
+def _placeFunnel(vias, xStep, yStep, numCols, originX=0.0, originY=0.0):
+    '''Shared placement kernel: drop the rings in a Vias SoA onto the current
+    board on a grid, numCols rings per row, xStep/yStep mm between cells.
+    originX/originY offset the whole pattern, in mm.'''
+    plan = _computePlacement(vias, xStep, yStep, numCols, originX, originY)
+    sess = _beginSession(plan)
+    _placeRange(plan, sess, 0, len(vias.idx))
+    _endSession(sess)
+
+
+def _placeFunnelAsync(loadVias, xStep=0, yStep=25, numCols=4):
+    '''Run a placement without freezing the editor: the table load and numpy
+    precompute happen on a worker thread, then the board mutations are
+    marshalled back to the wx UI thread in batches of _BATCH rings behind a
+    progress dialog.  loadVias is a callable returning the Vias SoA.'''
+
+    def fail(dlg, sess, err):
+        '''Tear down a half-finished placement: close the dialog, roll the
+        commit back so no partial funnel is left on the board, and show the
+        error instead of losing it.'''
+        if dlg is not None:
+            dlg.Destroy()
+        if sess is not None and sess.commit is not None:
+            sess.commit.Revert()
+        wx.MessageBox('SRIG layout failed:\n\n%s' % err,
+                      'SRIG Layout', wx.OK | wx.ICON_ERROR)
+
+    def nextBatch(plan, sess, dlg, start):
+        n = len(plan.vias.idx)
+        stop = min(start + _BATCH, n)
+        try:
+            _placeRange(plan, sess, start, stop)
+            dlg.Update(stop)
+            if stop < n:
+                # yield to the event loop between batches so the UI stays live
+                wx.CallAfter(nextBatch, plan, sess, dlg, stop)
+            else:
+                _endSession(sess)
+                dlg.Destroy()
+        except Exception:
+            fail(dlg, sess, traceback.format_exc())
+
+    def startBatches(plan):
+        n = len(plan.vias.idx)
+        dlg = wx.ProgressDialog('SRIG Layout', 'Placing %d rings...' % n,
+                                maximum=max(n, 1))
+        try:
+            sess = _beginSession(plan)
+        except Exception:
+            fail(dlg, None, traceback.format_exc())
+            return
+        nextBatch(plan, sess, dlg, 0)
+
+    def work():
+        # a traceback on a daemon thread vanishes, so marshal any load/parse
+        # failure back to the UI thread as a message box
+        try:
+            plan = _computePlacement(loadVias(), xStep, yStep, numCols)
+        except Exception:
+            # format here: the exception context is gone once CallAfter runs
+            wx.CallAfter(fail, None, None, traceback.format_exc())
+            return
+        wx.CallAfter(startBatches, plan)
+
+    threading.Thread(target=work, daemon=True).start()
+
+
+def funnelFromCSV(winFrame, xStep=0, yStep=25, numCols=4):
+    '''Place the funnel rings described by winFrame.csvName on a grid.'''
+    _placeFunnel(restoreCSV(winFrame.csvName), xStep, yStep, numCols)
+
+
+def funnelFromJson(winFrame, xStep=0, yStep=25, numCols=4):
+    '''Same as funnelFromCSV but driven by a JSON ring table.'''
+    _placeFunnel(_viasFromDict(restoreJSON(winFrame.jsonName)),
+                 xStep, yStep, numCols)
+
+
+def _selectedFootprints(pcb):
+    '''Footprints in the current selection.  Asks the editor for the selection
+    directly when the API allows, rather than testing IsSelected on every
+    footprint on the board.'''
+    if hasattr(pcbnew, 'GetCurrentSelection'):
+        return [it for it in pcbnew.GetCurrentSelection()
+                if isinstance(it, pcbnew.FOOTPRINT)]
+    return [fp for fp in pcb.GetFootprints() if fp.IsSelected()]
+
+
+def distributeX(xStep=100):
+    '''Spread the selected footprints along X, xStep mils apart.'''
+    pcb = pcbnew.GetBoard()
+    stepIU = int(xStep * IU_PER_MIL)
+    for m, fp in enumerate(_selectedFootprints(pcb)):
+        pos = fp.GetPosition()
+        fp.SetPosition(pcbnew.VECTOR2I(pos.x + stepIU * m, pos.y))
+    pcbnew.Refresh()
+
+
+def distributeY(yStep=100):
+    '''Spread the selected footprints along Y, yStep mils apart.'''
+    pcb = pcbnew.GetBoard()
+    stepIU = int(yStep * IU_PER_MIL)
+    for m, fp in enumerate(_selectedFootprints(pcb)):
+        pos = fp.GetPosition()
+        fp.SetPosition(pcbnew.VECTOR2I(pos.x, pos.y + stepIU * m))
+    pcbnew.Refresh()
+
+
+def distributeXY(xStep=200, yStep=200, numCols=10):
+    '''Arrange the selected footprints on a grid in natural reference order
+    (R2 before R10), numCols per row.'''
+    pcb = pcbnew.GetBoard()
+    fpList = _selectedFootprints(pcb)
+    fpNames = [fp.GetReference() for fp in fpList]
+
+    xStepIU = int(xStep * IU_PER_MIL)
+    yStepIU = int(yStep * IU_PER_MIL)
+    for m, i in enumerate(_natural_order(fpNames)):
+        fp = fpList[i]
+        pos = fp.GetPosition()
+        fp.SetPosition(pcbnew.VECTOR2I(pos.x + xStepIU * (m % numCols),
+                                       pos.y + yStepIU * (m // numCols)))
+    pcbnew.Refresh()
+
+
+class distributeVias(pcbnew.ActionPlugin):
+    '''Action plugin entry: prompt for a ring table and place the funnel.'''
+
+    def defaults(self):
+        self.name = 'SRIG Layout'
+        self.category = 'Modify PCB'
+        self.description = 'Place SRIG/funnel vias from a CSV or JSON ring table'
+
+    def Run(self):
+        dlg = wx.FileDialog(None, 'Select ring table',
+                            wildcard='Ring tables (*.csv;*.json)|*.csv;*.json',
+                            style=wx.FD_OPEN | wx.FD_FILE_MUST_EXIST)
+        if dlg.ShowModal() != wx.ID_OK:
+            dlg.Destroy()
+            return
+        path = dlg.GetPath()
+        dlg.Destroy()
+
+        if path.lower().endswith('.json'):
+            loadVias = lambda: _viasFromDict(restoreJSON(path))
+        else:
+            loadVias = lambda: restoreCSV(path)
+        _placeFunnelAsync(loadVias)